@@ -1,82 +1,167 @@
 import asyncio
+import atexit
+import hashlib
 import json
 import logging
 import os
-from logging.handlers import TimedRotatingFileHandler
-from datetime import datetime, timedelta
-from aiogram import Bot, Dispatcher, F, types
-from aiogram.types import Message, InputFile, FSInputFile
+import queue
+import re
+import ssl
+import time
+from types import MappingProxyType
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from dataclasses import dataclass
+from datetime import datetime, timedelta, time as dt_time
+from functools import lru_cache
+from aiogram import Bot, Dispatcher, F, types, __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.types import Message, InputFile, BufferedInputFile
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
-from aiohttp import ClientSession, BasicAuth
+from aiohttp import ClientSession, BasicAuth, ClientError, ClientTimeout, TCPConnector
+import certifi
+import orjson
 import pytz
-import requests
-from requests.auth import HTTPBasicAuth, HTTPDigestAuth
-import shutil
 import configparser
 
 # --- Load Config from config.ini ---
 logger = logging.getLogger(__name__)
 
-config = configparser.ConfigParser()
-config.read('config.ini')
-logger.info("Config file loaded successfully.")
-
-# Загрузка общих настроек из config.ini
-BOT_TOKEN = config.get('bot', 'token').strip('"')
-logger.info(f"BOT_TOKEN loaded: {BOT_TOKEN}")
-TELEGRAM_GROUP_ID = int(config.get('bot', 'group_id'))
-logger.info(f"TELEGRAM_GROUP_ID loaded: {TELEGRAM_GROUP_ID}")
-BOT_NAME = config.get('bot', 'bot_name').strip('"')
-logger.info(f"BOT_NAME loaded: {BOT_NAME}")
-INDEX_JSON_URL = config.get('api', 'index_url').strip('"')
-logger.info(f"INDEX_JSON_URL loaded: {INDEX_JSON_URL}")
-ROUTPUT_SET_URL = config.get('api', 'routput_url').strip('"')
-logger.info(f"ROUTPUT_SET_URL loaded: {ROUTPUT_SET_URL}")
-AUTH_USER = config.get('api', 'auth_user').strip('"')
-logger.info(f"AUTH_USER loaded: {AUTH_USER}")
-AUTH_PASS = config.get('api', 'auth_pass').strip('"')
-logger.info(f"AUTH_PASS loaded: {AUTH_PASS}")
-AUTH_CREDENTIALS = (AUTH_USER, AUTH_PASS)
-POLL_INTERVAL = int(config.get('settings', 'poll_interval', fallback='3'))
-logger.info(f"POLL_INTERVAL loaded: {POLL_INTERVAL}")
-DAILY_REPORT_TIMES = json.loads(config.get('settings', 'daily_report_times', fallback='["17:30"]'))
-logger.info(f"DAILY_REPORT_TIMES loaded: {DAILY_REPORT_TIMES}")
-ROUTPUT_NAME = config.get('settings', 'routput_name', fallback='Вентиляция').strip('"')
-logger.info(f"ROUTPUT_NAME loaded: {ROUTPUT_NAME}")
-MOSCOW_TZ = pytz.timezone(config.get('settings', 'timezone', fallback='Europe/Moscow').strip('"'))
-logger.info(f"MOSCOW_TZ loaded: {MOSCOW_TZ}")
-
-# Загрузка настроек webhook
-WEBHOOK_HOST = config.get('webhook', 'host').strip('"')
-logger.info(f"WEBHOOK_HOST loaded: {WEBHOOK_HOST}")
-WEBHOOK_PATH = config.get('webhook', 'path', fallback="/").strip('"')
-logger.info(f"WEBHOOK_PATH loaded: {WEBHOOK_PATH}")
-WEBHOOK_URL = f"https://{WEBHOOK_HOST}{WEBHOOK_PATH}"
-logger.info(f"WEBHOOK_URL loaded: {WEBHOOK_URL}")
-
-# Загрузка настроек web app
-WEBAPP_HOST = config.get('webapp', 'host', fallback="0.0.0.0").strip('"')
-logger.info(f"WEBAPP_HOST loaded: {WEBAPP_HOST}")
-WEBAPP_PORT = int(config.get('webapp', 'port', fallback='8777'))
-logger.info(f"WEBAPP_PORT loaded: {WEBAPP_PORT}")
-DEFAULT_CAMERA_CHANNEL = config.get('default','default',fallback='17').strip('"')
-logger.info(f"DEFAULT_CAMERA_CHANNEL loaded: {DEFAULT_CAMERA_CHANNEL}")
+
+@dataclass(frozen=True, slots=True)
+class Cfg:
+    """Настройки бота из config.ini (разбираются один раз при запуске)."""
+    bot_token: str
+    group_id: int
+    bot_name: str
+    connection_pool_size: int
+    updates_pool_size: int
+    request_timeout: float
+    index_url: str
+    routput_url: str
+    auth_user: str
+    auth_pass: str
+    poll_interval: int
+    fast_poll_interval: float
+    max_poll_interval: float
+    fast_poll_window: float
+    report_times: tuple[dt_time, ...]  # отсортированы
+    routput_name: str
+    timezone: pytz.BaseTzInfo
+    webhook_host: str
+    webhook_path: str
+    webhook_url: str
+    webapp_host: str
+    webapp_port: int
+    default_camera_channel: str
+    cameras: MappingProxyType[str, tuple[str, str, str]]  # chat_id -> (nvr, login, password)
+
+
+@lru_cache(maxsize=None)
+def load_cfg(path='config.ini') -> Cfg:
+    """Чтение config.ini и сборка неизменяемых настроек."""
+    config = configparser.ConfigParser()
+    config.read(path)
+
+    def get_str(section, key, **kwargs):
+        return config.get(section, key, **kwargs).strip('"')
+
+    webhook_host = get_str('webhook', 'host')
+    webhook_path = get_str('webhook', 'path', fallback="/")
+    daily_report_times = json.loads(config.get('settings', 'daily_report_times', fallback='["17:30"]'))
+    cfg = Cfg(
+        bot_token=get_str('bot', 'token'),
+        group_id=int(config.get('bot', 'group_id')),
+        bot_name=get_str('bot', 'bot_name'),
+        connection_pool_size=int(config.get('bot', 'connection_pool_size', fallback='32')),
+        updates_pool_size=int(config.get('bot', 'updates_pool_size', fallback='4')),
+        # pool_timeout — прежнее название того же параметра
+        request_timeout=float(config.get('bot', 'request_timeout', fallback=config.get('bot', 'pool_timeout', fallback='60'))),
+        index_url=get_str('api', 'index_url'),
+        routput_url=get_str('api', 'routput_url'),
+        auth_user=get_str('api', 'auth_user'),
+        auth_pass=get_str('api', 'auth_pass'),
+        poll_interval=int(config.get('settings', 'poll_interval', fallback='3')),
+        fast_poll_interval=float(config.get('settings', 'fast_poll_interval', fallback='1')),
+        max_poll_interval=float(config.get('settings', 'max_poll_interval', fallback='30')),
+        fast_poll_window=float(config.get('settings', 'fast_poll_window', fallback='120')),
+        report_times=tuple(sorted(datetime.strptime(report_time, "%H:%M").time() for report_time in daily_report_times)),
+        routput_name=get_str('settings', 'routput_name', fallback='Вентиляция'),
+        timezone=pytz.timezone(get_str('settings', 'timezone', fallback='Europe/Moscow')),
+        webhook_host=webhook_host,
+        webhook_path=webhook_path,
+        webhook_url=f"https://{webhook_host}{webhook_path}",
+        webapp_host=get_str('webapp', 'host', fallback="0.0.0.0"),
+        webapp_port=int(config.get('webapp', 'port', fallback='8777')),
+        default_camera_channel=get_str('default', 'default', fallback='17'),
+        cameras=MappingProxyType({section: (config[section]['nvr'], config[section]['login'], config[section]['password'])
+                                  for section in config.sections() if config.has_option(section, 'nvr')}),
+    )
+    logger.info("Config file loaded successfully.")
+    return cfg
+
+
+CFG = load_cfg()
+INODE_AUTH = BasicAuth(CFG.auth_user, CFG.auth_pass)
+DEFAULT_CAMERA_CHAT = '-1001432069292'  # Настройки камеры по умолчанию, если для чата нет своей секции
 # --- End load from config.ini ---
 
 
+class PooledAiohttpSession(AiohttpSession):
+    """Сессия aiogram с собственным пулом соединений ограниченного размера.
+
+    aiogram 3.4 не принимает limit в конструкторе, поэтому ClientSession с нужным
+    TCPConnector создается здесь, а не через внутренние настройки AiohttpSession.
+    """
+
+    def __init__(self, pool_size, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_size = pool_size
+        self._pooled_session = None
+
+    async def create_session(self):
+        if self._pooled_session is None or self._pooled_session.closed:
+            connector = TCPConnector(limit=self.pool_size, ssl=ssl.create_default_context(cafile=certifi.where()))
+            self._pooled_session = ClientSession(connector=connector,
+                                                 headers={"User-Agent": f"aiogram/{aiogram_version}"})
+        return self._pooled_session
+
+    async def close(self):
+        if self._pooled_session is not None and not self._pooled_session.closed:
+            await self._pooled_session.close()
+        await super().close()
+
+
+def make_bot_session(pool_size):
+    """Создание сессии aiogram с собственным пулом соединений."""
+    # request_timeout ограничивает весь запрос к Telegram API (включая загрузку фото), а не только ожидание пула
+    return PooledAiohttpSession(pool_size, timeout=CFG.request_timeout)
+
+
 # Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
+# bot — исходящие уведомления и фото, webhook_bot — ответы на команды из webhook,
+# чтобы всплеск уведомлений не занимал соединения, нужные интерактивным командам
+bot = Bot(token=CFG.bot_token, session=make_bot_session(CFG.connection_pool_size))
+webhook_bot = Bot(token=CFG.bot_token, session=make_bot_session(CFG.updates_pool_size))
 logger.info("Bot initialized.")
 dp = Dispatcher()
 logger.info("Dispatcher initialized.")
 
+# Команды бота (с упоминанием бота в группе)
+START_CMD = f"/start@{CFG.bot_name}"
+INFO_CMD = f"/get_info@{CFG.bot_name}"
+CAM_CMD = f"/get_cam@{CFG.bot_name}"
+CAM_CMD_LEN = len(CAM_CMD)
+
 # Хранение предыдущих состояний датчиков и вытяжки
 previous_sensors_state = {}
 previous_routput_state = None
+previous_payload_hash = None  # Хеш ответа, по которому получены previous_*_state
 bot_initialized = False  # Флаг для отслеживания инициализации бота
-report_sent_status = {time: False for time in DAILY_REPORT_TIMES}  # Флаг для отслеживания отправки отчета для каждого времени
-dinput_alarm_start_times = {}  # Время начала alarm для dinputs
+dinput_alarm_state = {}  # Для dinputs в alarm: {'started': ..., 'next_warn': ...} по time.monotonic()
+ALARM_WARNING_INTERVAL = 300  # Повторять предупреждение о длительном alarm каждые 5 минут
+TELEGRAM_MESSAGE_LIMIT = 4096  # Максимальная длина текста одного сообщения Telegram
+HTTP_SESSION: ClientSession | None = None  # Общая HTTP-сессия для запросов к iNode (keep-alive)
 logger.info("Variables initialized.")
 
 # --- Logging Setup ---
@@ -86,7 +171,9 @@ LOG_FILE = os.path.join(LOG_DIR, "bot.log")
 
 # Configure logger
 # logger = logging.getLogger(__name__) # already created
-logger.setLevel(logging.DEBUG)  # Set the root logger level to DEBUG
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()  # DEBUG только через LOG_LEVEL=DEBUG
+invalid_log_level = not isinstance(logging.getLevelName(LOG_LEVEL), int)
+logger.setLevel("INFO" if invalid_log_level else LOG_LEVEL)
 
 # Create file handler with rotation
 log_handler = TimedRotatingFileHandler(LOG_FILE, when="midnight", interval=1, backupCount=7, encoding="utf-8")
@@ -101,178 +188,283 @@ formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datef
 log_handler.setFormatter(formatter)
 console_handler.setFormatter(formatter)
 
+# Write to file/console from a separate thread so logging never blocks the event loop
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, log_handler, console_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 # Add handlers to the logger
-logger.addHandler(log_handler)
-logger.addHandler(console_handler)
+logger.addHandler(QueueHandler(log_queue))
 logger.info("Logging setup complete.")
+if invalid_log_level:
+    logger.warning(f"Unknown LOG_LEVEL '{LOG_LEVEL}', falling back to INFO.")
 
 # --- End Logging Setup ---
 
 
+async def get_session():
+    """Получение общей HTTP-сессии (создается один раз и переиспользуется)."""
+    global HTTP_SESSION
+    if HTTP_SESSION is None or HTTP_SESSION.closed:
+        HTTP_SESSION = ClientSession(connector=TCPConnector(limit=8, keepalive_timeout=75))
+        logger.info("HTTP session created.")
+    return HTTP_SESSION
+
+
 async def fetch_json(url):
-    """Получение JSON с сервера."""
-    logger.info(f"Fetching JSON from URL: {url}")
+    """Получение JSON с сервера. Возвращает (данные, исходные байты ответа)."""
+    logger.debug("Fetching JSON from URL: %s", url)
     try:
-        async with ClientSession() as session:
-            auth = BasicAuth(*AUTH_CREDENTIALS)
-            try:
-                async with session.get(url, auth=auth) as response:
-                    logger.info(f"Response status: {response.status}")
-                    if response.status == 200:
-                        data =  await response.json()
-                        logger.debug(f"JSON data received: {data}")
-                        return data
-                    else:
-                        logger.error(f"Не удалось получить JSON с {url}. Код статуса: {response.status}")
-                        return None
-            except Exception as e:
-                logger.error(f"Ошибка получения JSON с {url}. Ошибка: {e}")
-                return None
+        session = await get_session()
+        async with session.get(url, auth=INODE_AUTH, timeout=ClientTimeout(total=10)) as response:
+            logger.debug("Response status: %s", response.status)
+            if response.status == 200:
+                raw = await response.read()
+                data = orjson.loads(raw)
+                logger.debug("JSON data received: %s", data)
+                return data, raw
+            else:
+                logger.error(f"Не удалось получить JSON с {url}. Код статуса: {response.status}")
+                return None, None
     except Exception as e:
-        logger.error(f"Ошибка при создании сессии для fetch_json: {e}")
-        return None
-
-
-def parse_sensors_data(data):
-    """Разбор и форматирование данных датчиков из JSON."""
-    logger.info("Parsing sensor data.")
+        logger.error(f"Ошибка получения JSON с {url}. Ошибка: {e}")
+        return None, None
+
+
+def build_digest_header(method, url, login, password, challenge):
+    """Формирование заголовка Authorization для HTTP Digest по заголовку WWW-Authenticate."""
+    fields = {key.lower(): quoted or plain
+              for key, quoted, plain in re.findall(r'(\w+)=(?:"([^"]*)"|([^\s,]*))', challenge)}
+    realm = fields.get('realm', '')
+    nonce = fields.get('nonce', '')
+    opaque = fields.get('opaque')
+    algorithm = fields.get('algorithm', 'MD5')
+    qop = 'auth' if 'auth' in fields.get('qop', '').replace(' ', '').split(',') else None
+    hash_func = hashlib.sha256 if algorithm.upper().startswith('SHA-256') else hashlib.md5
+
+    def digest(value):
+        return hash_func(value.encode()).hexdigest()
+
+    uri = url.split('://', 1)[-1]
+    uri = uri[uri.find('/'):] if '/' in uri else '/'
+    cnonce = os.urandom(8).hex()
+    nonce_count = '00000001'
+    ha1 = digest(f"{login}:{realm}:{password}")
+    if algorithm.upper().endswith('-SESS'):
+        ha1 = digest(f"{ha1}:{nonce}:{cnonce}")
+    ha2 = digest(f"{method}:{uri}")
+    if qop:
+        response = digest(f"{ha1}:{nonce}:{nonce_count}:{cnonce}:{qop}:{ha2}")
+    else:
+        response = digest(f"{ha1}:{nonce}:{ha2}")
+
+    header = (f'Digest username="{login}", realm="{realm}", nonce="{nonce}", uri="{uri}", '
+              f'response="{response}", algorithm={algorithm}')
+    if opaque is not None:
+        header += f', opaque="{opaque}"'
+    if qop:
+        header += f', qop={qop}, nc={nonce_count}, cnonce="{cnonce}"'
+    return header
+
+
+async def digest_get(session, url, login, password, **kwargs):
+    """GET-запрос с HTTP Digest авторизацией (запрос, 401 с nonce, повтор с подписью)."""
+    response = await session.get(url, **kwargs)
+    challenge = response.headers.get('WWW-Authenticate', '')
+    if response.status == 401 and challenge.lower().startswith('digest'):
+        response.release()
+        headers = {'Authorization': build_digest_header('GET', url, login, password, challenge)}
+        response = await session.get(url, headers=headers, **kwargs)
+    return response
+
+
+class SensorSample:
+    """Состояние одного датчика за опрос (__slots__ — без словаря на каждый объект)."""
+    __slots__ = ('status', 'value', 'dim')
+
+    def __init__(self, status, value=None, dim=None):
+        self.status, self.value, self.dim = status, value, dim
+
+    def __repr__(self):
+        return f"SensorSample(status={self.status!r}, value={self.value!r}, dim={self.dim!r})"
+
+
+def parse_payload(data):
+    """Разбор данных датчиков и состояния вытяжки из JSON за один проход."""
+    logger.debug("Parsing sensor and routput data.")
     try:
         parsed_sensors = {}
-        if "dinputs" in data:
-            for dinput in data["dinputs"]:
-                parsed_sensors[dinput['name']] = {'status': dinput['status']}
-                logger.debug(f"Parsed dinput: {dinput['name']}")
-
-        if 'sensors' in data:
-            for sensor in data["sensors"]:
-                if sensor['name'] != '':
-                    parsed_sensors[sensor['name']] = {'status': sensor['status'], 'value': sensor.get('value', None),
-                                                    'dim': sensor.get('dim', None)}
-                    logger.debug(f"Parsed sensor: {sensor['name']}")
-        logger.debug(f"Parsed sensors: {parsed_sensors}")
-        return parsed_sensors
-    except Exception as e:
-        logger.error(f"Ошибка при парсинге данных датчиков: {e}")
-        return {}
+        for dinput in data.get("dinputs", ()):
+            parsed_sensors[dinput['name']] = SensorSample(dinput['status'])
 
+        for sensor in data.get("sensors", ()):
+            if sensor['name'] != '':
+                parsed_sensors[sensor['name']] = SensorSample(sensor['status'], sensor.get('value'), sensor.get('dim'))
 
-def parse_routput_status(data):
-    """Разбор состояния вытяжки из JSON."""
-    logger.info("Parsing routput status.")
-    try:
-        routput = data.get("routput", {})
-        parsed_routput = {'name': routput.get('name', None), 'state': routput.get('state', 'off')} if routput else None
-        logger.debug(f"Parsed routput: {parsed_routput}")
-        return parsed_routput
+        routput = data.get("routput") or {}
+        parsed_routput = {'name': routput.get('name'), 'state': routput.get('state', 'off')} if routput else None
+        logger.debug("Parsed sensors: %s, routput: %s", parsed_sensors, parsed_routput)
+        return parsed_sensors, parsed_routput
     except Exception as e:
-        logger.error(f"Ошибка при парсинге данных вытяжки: {e}")
-        return None
+        logger.error(f"Ошибка при парсинге данных датчиков: {e}")
+        return {}, None
 
 
 async def send_daily_report():
     """Отправка ежедневного отчета о состоянии датчиков."""
     logger.info("Sending daily report.")
     try:
-        json_data = await fetch_json(INDEX_JSON_URL)
+        json_data, _ = await fetch_json(CFG.index_url)
         if not json_data:
             return
 
-        sensors_data = parse_sensors_data(json_data)
-        routput_info = parse_routput_status(json_data)
+        sensors_data, routput_info = parse_payload(json_data)
 
         report = "Ежедневный отчет:\n\n"
         for sensor_name, sensor_info in sensors_data.items():
-            report += f"{sensor_name}, Состояние: <b>{sensor_info.get('status')}</b>"
-            if sensor_info.get('value'):
-                report += f", Значение: <b>{sensor_info.get('value')}{sensor_info.get('dim', '')}</b>"
+            report += f"{sensor_name}, Состояние: <b>{sensor_info.status}</b>"
+            if sensor_info.value:
+                report += f", Значение: <b>{sensor_info.value}{sensor_info.dim or ''}</b>"
             report += "\n"
-        report += f"\nВытяжка '{routput_info.get('name', ROUTPUT_NAME)}' Состояние: <b>{routput_info.get('state')}</b>"
-        logger.debug(f"Daily report message: {report}")
-        await bot.send_message(TELEGRAM_GROUP_ID, report, parse_mode="HTML")
+        report += f"\nВытяжка '{routput_info.get('name', CFG.routput_name)}' Состояние: <b>{routput_info.get('state')}</b>"
+        logger.debug("Daily report message: %s", report)
+        await bot.send_message(CFG.group_id, report, parse_mode="HTML")
         logger.info("Daily report sent successfully.")
     except Exception as e:
         logger.error(f"Не удалось отправить ежедневный отчет. Ошибка: {e}")
 
 
+def chunk_alerts(alerts, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Группировка уведомлений в сообщения не длиннее лимита Telegram."""
+    chunks, current, current_len = [], [], 0
+    for alert in alerts:
+        added_len = len(alert) + (1 if current else 0)
+        if current and current_len + added_len > limit:
+            chunks.append("\n".join(current))
+            current, added_len = [], len(alert)
+            current_len = 0
+        current.append(alert)
+        current_len += added_len
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def payload_digest(raw_payload):
+    """Хеш исходных байтов ответа для проверки «ответ не изменился»."""
+    return hashlib.blake2b(raw_payload, digest_size=16).digest()
+
+
+async def send_alerts(alerts):
+    """Отправка накопленных за опрос уведомлений минимальным числом сообщений, по порядку."""
+    messages = chunk_alerts(alerts)
+    for message_text in messages:
+        try:
+            await bot.send_message(CFG.group_id, message_text, parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомления об изменении состояния. Ошибка: {e}")
+    logger.info(f"Sent {len(alerts)} alert(s) in {len(messages)} message(s).")
+
+
+def next_poll_interval(current_interval, fast_poll_until):
+    """Адаптивный интервал опроса: частый опрос после изменений, в покое — плавное увеличение."""
+    if time.monotonic() < fast_poll_until:
+        return CFG.fast_poll_interval
+    return min(current_interval * 1.5, CFG.max_poll_interval)
+
+
 async def monitor_changes():
     """Мониторинг изменений в данных датчиков и отправка уведомлений."""
-    global previous_sensors_state, previous_routput_state, bot_initialized, dinput_alarm_start_times
+    global previous_sensors_state, previous_routput_state, previous_payload_hash, bot_initialized, dinput_alarm_state
     logger.info("Starting monitor_changes loop.")
+    next_interval = CFG.poll_interval
+    fast_poll_until = 0.0
+    pending_send = None  # Отправка идет параллельно со сном и следующим опросом
     while True:
         try:
             if not bot_initialized:
                 logger.debug("Bot not initialized, sleeping.")
-                await asyncio.sleep(POLL_INTERVAL)
+                await asyncio.sleep(CFG.poll_interval)
                 continue
             
             logger.debug("Fetching JSON data for monitoring.")
-            json_data = await fetch_json(INDEX_JSON_URL)
+            json_data, raw_payload = await fetch_json(CFG.index_url)
             if not json_data:
                 logger.debug("Failed to fetch JSON, sleeping.")
-                await asyncio.sleep(POLL_INTERVAL)
-                continue        
+                await asyncio.sleep(CFG.poll_interval)
+                continue
+
+            # Ответ не изменился — разбор и сравнение не нужны (кроме отслеживания длительных alarm)
+            payload_hash = payload_digest(raw_payload)
+            if payload_hash == previous_payload_hash and not dinput_alarm_state:
+                next_interval = next_poll_interval(next_interval, fast_poll_until)
+                logger.debug("Payload unchanged, sleeping %.1fs.", next_interval)
+                await asyncio.sleep(next_interval)
+                continue
+            state_changed = False
+            alerts = []  # Все уведомления за один опрос отправляются одним сообщением
             
-            logger.debug("Parsing sensor and routput data.")
-            current_sensors_state = parse_sensors_data(json_data)
-            current_routput_info = parse_routput_status(json_data)
+            current_sensors_state, current_routput_info = parse_payload(json_data)
             current_routput_state = current_routput_info['state']
-            current_routput_name = current_routput_info.get('name', ROUTPUT_NAME)
+            current_routput_name = current_routput_info.get('name', CFG.routput_name)
             
             logger.debug("Checking for changes in sensor states.")
             # Проверка изменений в состоянии отдельных датчиков
-            for sensor_name, current_sensor_info in current_sensors_state.items():
-                previous_sensor_info = previous_sensors_state.get(sensor_name)
-                if previous_sensor_info is None or previous_sensor_info.get('status') != current_sensor_info.get('status'):
-                    alert = f"⚠️ Внимание! Изменение состояния '{sensor_name}': Новое состояние: <b>{current_sensor_info.get('status')}</b>"
-                    if current_sensor_info.get('value'):
-                        alert += f" , Значение: <b>{current_sensor_info.get('value')}{current_sensor_info.get('dim', '')}</b>"
-                    try:
-                        await bot.send_message(TELEGRAM_GROUP_ID, alert, parse_mode="HTML")
-                        logger.info(f"Sent sensor state change alert for: {sensor_name}")
-                    except Exception as e:
-                        logger.error(
-                            f"Не удалось отправить уведомление об изменении состояния датчика: {sensor_name}. Ошибка: {e}")
-                        
-                # Проверка dinputs на 'alarm' состояние
-                if 'dinputs' in json_data:
-                    for dinput in json_data['dinputs']:
-                        dinput_name = dinput['name']
-                        dinput_status = dinput['status']
-                        
-                        if dinput_status == 'alarm':
-                            if dinput_name not in dinput_alarm_start_times:
-                                dinput_alarm_start_times[dinput_name] = datetime.now(MOSCOW_TZ)
-                                logger.debug(f"Alarm start for dinput: {dinput_name}")
-                            else:
-                                alarm_duration = datetime.now(MOSCOW_TZ) - dinput_alarm_start_times[dinput_name]
-                                if alarm_duration >= timedelta(minutes=5) and alarm_duration.seconds % 300 <= POLL_INTERVAL:
-                                    warning = f"⚠️ WARNING !!\n{dinput_name} — <b>{dinput_status}</b> дольше 5-ти минут."
-                                    try:
-                                        await bot.send_message(TELEGRAM_GROUP_ID, warning, parse_mode="HTML")
-                                        logger.info(f"Sent dinput alarm warning for: {dinput_name}")
-                                    except Exception as e:
-                                        logger.error(f"Не удалось отправить уведомление об alarm для dinput: {dinput_name}. Ошибка: {e}")
-                                        
-                        elif dinput_name in dinput_alarm_start_times:
-                            del dinput_alarm_start_times[dinput_name] # Reset alarm time if status changed
-                            logger.debug(f"Alarm stopped for dinput: {dinput_name}")
+            changed_sensors = {name: info for name, info in current_sensors_state.items()
+                               if name not in previous_sensors_state or previous_sensors_state[name].status != info.status}
+            if changed_sensors:
+                state_changed = True
+            for sensor_name, current_sensor_info in changed_sensors.items():
+                alert = f"⚠️ Внимание! Изменение состояния '{sensor_name}': Новое состояние: <b>{current_sensor_info.status}</b>"
+                if current_sensor_info.value:
+                    alert += f" , Значение: <b>{current_sensor_info.value}{current_sensor_info.dim or ''}</b>"
+                alerts.append(alert)
+                logger.info(f"Sensor state change detected for: {sensor_name}")
+
+            # Проверка dinputs на 'alarm' состояние
+            if 'dinputs' in json_data:
+                now = time.monotonic()
+                for dinput in json_data['dinputs']:
+                    dinput_name = dinput['name']
+                    dinput_status = dinput['status']
+
+                    if dinput_status == 'alarm':
+                        alarm_state = dinput_alarm_state.get(dinput_name)
+                        if alarm_state is None:
+                            dinput_alarm_state[dinput_name] = {'started': now, 'next_warn': now + ALARM_WARNING_INTERVAL}
+                            logger.debug("Alarm start for dinput: %s", dinput_name)
+                        elif now >= alarm_state['next_warn']:
+                            alarm_state['next_warn'] = now + ALARM_WARNING_INTERVAL
+                            alerts.append(f"⚠️ WARNING !!\n{dinput_name} — <b>{dinput_status}</b> дольше 5-ти минут.")
+                            logger.info(f"Dinput alarm warning for: {dinput_name}")
+
+                    elif dinput_name in dinput_alarm_state:
+                        del dinput_alarm_state[dinput_name] # Reset alarm time if status changed
+                        logger.debug("Alarm stopped for dinput: %s", dinput_name)
 
             # Проверка изменений состояния вытяжки
             if previous_routput_state is None or previous_routput_state != current_routput_state:
-                alert = f"⚠️ Внимание! Изменение состояния вытяжки '{current_routput_name}': Новое состояние: <b>{current_routput_state}</b>"
-                try:
-                    await bot.send_message(TELEGRAM_GROUP_ID, alert, parse_mode="HTML")
-                    logger.info(f"Sent routput state change alert for: {current_routput_name}")
-                except Exception as e:
-                    logger.error(f"Не удалось отправить уведомление об изменении состояния вытяжки. Ошибка: {e}")
+                state_changed = True
+                alerts.append(f"⚠️ Внимание! Изменение состояния вытяжки '{current_routput_name}': Новое состояние: <b>{current_routput_state}</b>")
+                logger.info(f"Routput state change detected for: {current_routput_name}")
+
+            if alerts:
+                if pending_send is not None:
+                    await pending_send  # Сохраняем порядок уведомлений
+                pending_send = asyncio.create_task(send_alerts(alerts))
 
             previous_sensors_state = current_sensors_state
             previous_routput_state = current_routput_state
-            logger.debug("Finished checking for changes, sleeping.")
-            await asyncio.sleep(POLL_INTERVAL)
+            previous_payload_hash = payload_hash  # Только после успешного сравнения
+            if state_changed or dinput_alarm_state:
+                fast_poll_until = time.monotonic() + CFG.fast_poll_window
+            next_interval = next_poll_interval(next_interval, fast_poll_until)
+            logger.debug("Finished checking for changes, sleeping %.1fs.", next_interval)
+            await asyncio.sleep(next_interval)
         except Exception as e:
             logger.error(f"Произошла ошибка в основном цикле мониторинга: {e}")
-            await asyncio.sleep(POLL_INTERVAL)
+            await asyncio.sleep(CFG.poll_interval)
 
 
 ###################### POST request (not working) ######################
@@ -280,7 +472,7 @@ async def monitor_changes():
 # async def control_routput(action: str):
 #     """Отправка POST запроса для включения/выключения вытяжки."""
 #     async with ClientSession() as session:
-#         auth = BasicAuth(*AUTH_CREDENTIALS)
+#         auth = INODE_AUTH
 #         payload = {
 #             "routput_config": {
 #                 "maction": action,
@@ -289,7 +481,7 @@ async def monitor_changes():
 #         }
 #         headers = {'Content-Type': 'application/json'}
 #         try:
-#             async with session.post(ROUTPUT_SET_URL, auth=auth, json=payload, headers=headers) as response:
+#             async with session.post(CFG.routput_url, auth=auth, json=payload, headers=headers) as response:
 #                  logger.info(f"Response status: {response.status}")
 #                  if response.status == 200:
 #                     json_data = await response.json()
@@ -306,24 +498,25 @@ async def monitor_changes():
 #             return f'Ошибка при отправке запроса. Ошибка: {e}'
 
 
-@dp.message(F.text == f"/start@{BOT_NAME}")
+@dp.message(F.text == START_CMD)
 async def cmd_start(message: Message):
     """Обработка команды /start."""
     logger.info(f"Received /start command from chat: {message.chat.id}")
     try:
-        if message.chat.id != TELEGRAM_GROUP_ID:
+        if message.chat.id != CFG.group_id:
             logger.info(f"Command /start from unauthorized chat: {message.chat.id}")
             return
-        global previous_sensors_state, previous_routput_state, bot_initialized
+        global previous_sensors_state, previous_routput_state, previous_payload_hash, bot_initialized
 
         # Получение начальных состояний датчиков и вытяжки
         logger.debug("Fetching initial data for /start command.")
-        json_data = await fetch_json(INDEX_JSON_URL)
-        logger.debug(f"Fetched data for /start command: {json_data}")
+        json_data, raw_payload = await fetch_json(CFG.index_url)
+        logger.debug("Fetched data for /start command: %s", json_data)
         if json_data:
-            previous_sensors_state = parse_sensors_data(json_data)
-            previous_routput_state = parse_routput_status(json_data)['state']
-            logger.debug(f"parsed data  for /start command: sensors={previous_sensors_state}, routput= {previous_routput_state}")
+            previous_sensors_state, routput_info = parse_payload(json_data)
+            previous_routput_state = routput_info['state']
+            previous_payload_hash = payload_digest(raw_payload)
+            logger.debug("parsed data  for /start command: sensors=%s, routput= %s", previous_sensors_state, previous_routput_state)
             bot_initialized = True
             logger.info(f"bot_initialized is {bot_initialized}")
             await message.reply("Бот запущен и готов к работе!")
@@ -336,34 +529,33 @@ async def cmd_start(message: Message):
         await message.reply("Произошла ошибка при выполнении команды.")
 
 
-@dp.message(F.text == f"/get_info@{BOT_NAME}")
+@dp.message(F.text == INFO_CMD)
 async def cmd_get_info(message: Message):
     """Обработка команды /get_info."""
     logger.info(f"Received /get_info command from chat: {message.chat.id}")
     try:
-        if message.chat.id != TELEGRAM_GROUP_ID:
+        if message.chat.id != CFG.group_id:
             logger.info(f"Command /get_info from unauthorized chat: {message.chat.id}")
             return
         logger.debug("Fetching data for /get_info command.")
-        json_data = await fetch_json(INDEX_JSON_URL)
+        json_data, _ = await fetch_json(CFG.index_url)
         if not json_data:
             await message.reply("Не удалось получить данные.")
             logger.warning("Failed to fetch data for /get_info command.")
             return
 
-        sensors_data = parse_sensors_data(json_data)
-        routput_info = parse_routput_status(json_data)
-        logger.debug(f"Parsed data for /get_info: sensors={sensors_data}, routput={routput_info}")
+        sensors_data, routput_info = parse_payload(json_data)
+        logger.debug("Parsed data for /get_info: sensors=%s, routput=%s", sensors_data, routput_info)
 
         response = "📍Текущее состояние датчиков:\n\n"
         for sensor_name, sensor_info in sensors_data.items():
-            response += f"{sensor_name} — <b>{sensor_info.get('status')}</b>"
-            if sensor_info.get('value'):
-                response += f" — <b>{sensor_info.get('value')}{sensor_info.get('dim', '')}</b>"
+            response += f"{sensor_name} — <b>{sensor_info.status}</b>"
+            if sensor_info.value:
+                response += f" — <b>{sensor_info.value}{sensor_info.dim or ''}</b>"
             response += "\n"
-        response += f"\n'{routput_info.get('name', ROUTPUT_NAME)}' — <b>{routput_info.get('state')}</b>"
+        response += f"\n'{routput_info.get('name', CFG.routput_name)}' — <b>{routput_info.get('state')}</b>"
 
-        logger.debug(f"Response message for /get_info: {response}")
+        logger.debug("Response message for /get_info: %s", response)
         await message.reply(response, parse_mode="HTML")
         logger.info("Sent /get_info response successfully.")
     except Exception as e:
@@ -371,21 +563,21 @@ async def cmd_get_info(message: Message):
         await message.reply("Произошла ошибка при выполнении команды.")
 
 
-@dp.message(F.text.startswith(f"/get_cam@{BOT_NAME}"))
+@dp.message(F.text.startswith(CAM_CMD))
 async def cmd_get_camera(message: Message):
     """Обработчик команд /get_cam и /get_cam[channel]."""
     logger.info(f"Received /get_cam command from chat: {message.chat.id}")
     try:
-        if message.chat.id != TELEGRAM_GROUP_ID:
+        if message.chat.id != CFG.group_id:
             logger.info(f"Command /get_cam from unauthorized chat: {message.chat.id}")
             return
         text = message.text
-        if text == f"/get_cam@{BOT_NAME}":
+        if text == CAM_CMD:
            await cmd_camera(message)
            logger.info(f"Executed /get_cam command successfully, default channel")
-        elif text.startswith(f"/get_cam@{BOT_NAME}"):
+        elif text.startswith(CAM_CMD):
             try:
-                 channel = text[len(f"/get_cam@{BOT_NAME}"):].strip() # Extract the channel number from the command
+                 channel = text[CAM_CMD_LEN:].strip() # Extract the channel number from the command
                  channel = int(channel)
                  await cmd_camera(message, channel)
                  logger.info(f"Executed /get_cam command successfully, channel: {channel}")
@@ -397,49 +589,41 @@ async def cmd_get_camera(message: Message):
         await message.reply("Произошла ошибка при выполнении команды.")
 
 
-async def cmd_camera(update: Message, channel: str = DEFAULT_CAMERA_CHANNEL):
+async def cmd_camera(update: Message, channel: str = CFG.default_camera_channel):
     """Обработка запроса на получение снимка с камеры."""
     logger.info(f"Starting cmd_camera function with channel: {channel}")
     try:
-      logger.debug(str(update.chat))
-      logger.debug(str(update.from_user.first_name) + ' ' + str(update.from_user.last_name) + ' ' + str(
-          update.from_user.id) + ' : ' + update.text)
+      logger.debug("%s", update.chat)
+      logger.debug("%s %s %s : %s", update.from_user.first_name, update.from_user.last_name,
+                   update.from_user.id, update.text)
       try:
-          chat_id = str(update.chat.id) if config.has_section(
-              str(update.chat.id)) else '-1001432069292'
-          url = f"http://{config[chat_id]['nvr']}/cgi-bin/snapshot.cgi?channel={channel}"
-          logger.debug(f"Camera URL: {url}")
-          # Delete old image if it exists
-          if os.path.exists('img/img.jpeg'):
-            os.remove('img/img.jpeg')
-            logger.debug(f"Old image removed")
-
-          auth = HTTPDigestAuth(config[chat_id]['login'], config[chat_id]['password'])
-          logger.debug(f"Authentication set for camera: user = {config[chat_id]['login']}")
-          response = requests.get(url, auth=auth, stream=True)
-          response.raise_for_status()
-          logger.debug(f"Response code: {response.status_code}")
-          if response.status_code == 200:
-              with open('img/img.jpeg', 'wb') as out_file:
-                  shutil.copyfileobj(response.raw, out_file)
-                  logger.debug(f"Image downloaded to img/img.jpeg")
-              
-              try:
-                   photo = FSInputFile('img/img.jpeg')
-                   await bot.send_photo(chat_id=update.chat.id, photo=photo)
-                   logger.info(f"Sent photo to chat: {update.chat.id}")
-              except Exception as e:
-                  logger.error(f"Error sending photo to Telegram: {e}")
-                  await update.reply(f"Ошибка при отправке фото в телеграмм: {e}")
-
-              del response
-              logger.debug(f"response deleted.")
-
-          else:
-            await update.reply(f"{response.status_code} - {response.reason}")
-            logger.error(f"Error during camera snapshot request: {response.status_code} - {response.reason}")
-              
-      except requests.exceptions.RequestException as e:
+          nvr, login, password = CFG.cameras.get(str(update.chat.id)) or CFG.cameras[DEFAULT_CAMERA_CHAT]
+          url = f"http://{nvr}/cgi-bin/snapshot.cgi?channel={channel}"
+          logger.debug("Camera URL: %s", url)
+
+          logger.debug("Authentication set for camera: user = %s", login)
+          session = await get_session()
+          async with await digest_get(session, url, login, password, timeout=ClientTimeout(total=30)) as response:
+              logger.debug("Response code: %s", response.status)
+              if response.status == 200:
+                  image = bytearray()
+                  async for chunk in response.content.iter_chunked(65536):
+                      image += chunk
+                  logger.debug("Image downloaded: %d bytes", len(image))
+              else:
+                  await update.reply(f"{response.status} - {response.reason}")
+                  logger.error(f"Error during camera snapshot request: {response.status} - {response.reason}")
+                  return
+
+          try:
+               photo = BufferedInputFile(bytes(image), filename="cam.jpg")
+               await bot.send_photo(chat_id=update.chat.id, photo=photo)
+               logger.info(f"Sent photo to chat: {update.chat.id}")
+          except Exception as e:
+              logger.error(f"Error sending photo to Telegram: {e}")
+              await update.reply(f"Ошибка при отправке фото в телеграмм: {e}")
+
+      except ClientError as e:
           logger.error(f"Error during camera snapshot request: {e}")
           await update.reply(f"Ошибка при запросе снимка с камеры: {e}")
       except Exception as e:
@@ -450,29 +634,32 @@ async def cmd_camera(update: Message, channel: str = DEFAULT_CAMERA_CHANNEL):
         await update.reply(f"Произошла ошибка при выполнении запроса к камере {e}")
 
 
+def next_report_datetime(after):
+    """Ближайшее время ежедневного отчета строго после `after`."""
+    for day_offset in (0, 1):
+        report_date = after.date() + timedelta(days=day_offset)
+        for report_time in CFG.report_times:
+            target_datetime = CFG.timezone.localize(datetime.combine(report_date, report_time))
+            if target_datetime > after:
+                return target_datetime
+
+
 async def scheduler():
     """Планировщик для ежедневного отчета."""
-    global report_sent_status
     logger.info("Starting scheduler loop.")
+    if not CFG.report_times:
+        logger.warning("daily_report_times is empty, daily reports are disabled.")
+        return
+    next_fire = next_report_datetime(datetime.now(CFG.timezone))
     while True:
         try:
-            now = datetime.now(MOSCOW_TZ)  # Current time in Moscow
-            logger.debug(f"Scheduler current time: {now}")
-            for report_time in DAILY_REPORT_TIMES:
-                target_time = datetime.strptime(report_time, "%H:%M").time()
-                target_datetime = datetime.combine(now.date(), target_time, tzinfo=MOSCOW_TZ)
-                logger.debug(f"Scheduler target time: {target_datetime}")
-
-                if now >= target_datetime and not report_sent_status[report_time]:
-                    await send_daily_report()
-                    report_sent_status[report_time] = True
-                    logger.info(f"Daily report has been sent for {report_time}.")
-    # Reset all report flags at the start of the next day
-            if now.hour == 0 and now.minute == 0:
-                report_sent_status = {time: False for time in DAILY_REPORT_TIMES}
-                logger.info("Resetting daily report flags.")
-
-            await asyncio.sleep(60)
+            logger.debug("Scheduler next report time: %s", next_fire)
+            # Сон до момента отчета не дольше минуты за раз, чтобы учитывать переводы системных часов (NTP)
+            while (delay := (next_fire - datetime.now(CFG.timezone)).total_seconds()) > 0:
+                await asyncio.sleep(min(delay, 60))
+            await send_daily_report()
+            logger.info(f"Daily report has been sent for {next_fire:%H:%M}.")
+            next_fire = next_report_datetime(max(next_fire, datetime.now(CFG.timezone)))
         except Exception as e:
             logger.error(f"Ошибка в планировщике: {e}")
             await asyncio.sleep(60)
@@ -481,6 +668,9 @@ async def main():
     """Основная функция запуска бота."""
     logger.info("Starting main function.")
     try:
+        # Общая HTTP-сессия должна существовать до запуска фоновых задач
+        await get_session()
+
         # Запуск планировщика и мониторинга в фоновом режиме
         logger.info("Creating background tasks for monitoring and scheduler.")
         asyncio.create_task(monitor_changes())
@@ -499,8 +689,8 @@ async def main():
         logger.info("Bot commands set.")
 
         # Set webhook
-        logger.info(f"Setting webhook URL: {WEBHOOK_URL}")
-        await bot.set_webhook(url=WEBHOOK_URL)
+        logger.info(f"Setting webhook URL: {CFG.webhook_url}")
+        await bot.set_webhook(url=CFG.webhook_url)
         logger.info("Webhook set.")
 
         # Create aiohttp app for webhook
@@ -508,21 +698,21 @@ async def main():
         app = web.Application()
         webhook_requests_handler = SimpleRequestHandler(
             dispatcher=dp,
-            bot=bot
+            bot=webhook_bot
         )
 
         # Mount dispatcher to application
-        webhook_requests_handler.register(app, path=WEBHOOK_PATH)
+        webhook_requests_handler.register(app, path=CFG.webhook_path)
 
         # Setup application and add to main
         logger.info("Setting up application and adding to main.")
-        setup_application(app, dp, bot=bot)
+        setup_application(app, dp, bot=webhook_bot)
         
         # Start webserver
-        logger.info(f"Starting web server on host: {WEBAPP_HOST} and port: {WEBAPP_PORT}")
+        logger.info(f"Starting web server on host: {CFG.webapp_host} and port: {CFG.webapp_port}")
         runner = web.AppRunner(app)
         await runner.setup()
-        site = web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT)
+        site = web.TCPSite(runner, host=CFG.webapp_host, port=CFG.webapp_port)
         await site.start()
         logger.info("Web server started.")
 
@@ -536,6 +726,12 @@ async def main():
           logger.info("Cleaning up runner.")
           await runner.cleanup()
           logger.info("Runner cleaned up.")
+          await bot.session.close()
+          await webhook_bot.session.close()
+          logger.info("Bot sessions closed.")
+          if HTTP_SESSION is not None:
+              await HTTP_SESSION.close()
+              logger.info("HTTP session closed.")
     except Exception as e:
         logger.error(f"Произошла ошибка при запуске main(): {e}")
 